@@ -1,118 +1,250 @@
+import io
+
+import numpy as np
 import streamlit as st
 import pandas as pd
+import plotly.express as px
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; small frames use the NumPy path anyway
+    njit = None
+
+
+# Method ids for the fused fairness kernel
+_METHOD_IDS = {"difference": 0, "proportional": 1, "ratio": 2}
+
+# Below this row count the chained NumPy path wins; above it the fused
+# single-pass kernel avoids ~7 full-array temporaries
+_NUMBA_MIN_ROWS = 10_000
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _fairness_kernel(b, p, method_id, bs, ps, fi, fr):
+        total_budget = b.sum()
+        total_population = p.sum()
+        for i in range(b.shape[0]):
+            bs_i = b[i] * 100.0 / total_budget
+            ps_i = p[i] * 100.0 / total_population
+            safe_ps_i = ps_i if ps_i != 0 else 1.0
+            bs[i] = bs_i
+            ps[i] = ps_i
+            fr[i] = bs_i / safe_ps_i
+            if method_id == 0:  # difference
+                fi[i] = bs_i - ps_i
+            elif method_id == 1:  # proportional, clipped to 0-100%
+                v = 1.0 - abs(bs_i - ps_i) / safe_ps_i
+                if v < 0.0:
+                    v = 0.0
+                elif v > 1.0:
+                    v = 1.0
+                fi[i] = v * 100.0
+            else:  # ratio
+                fi[i] = (bs_i / safe_ps_i - 1.0) * 100.0
+
+
+# Required CSV columns besides sector, which load_csv moves to the index
+_REQUIRED_COLS = frozenset({'budget', 'population'})
+
+# Static UI tables, built once at import rather than on every rerun
+_METHOD_LABELS = {
+    "difference": "Simple Difference",
+    "proportional": "Proportional Deviation",
+    "ratio": "Ratio-based"
+}
+
+_FAIRNESS_NOTES = {
+    "proportional": "Higher percentage = more fair (100% = perfectly proportional)",
+    "negative": "Negative values indicate under-funding relative to population share.",
+    "positive": "Positive values indicate over-funding relative to population share."
+}
+
+_EXPLANATIONS = {
+    "difference": "**Method:** Simple Difference (Budget Share % - Population Share %)",
+    "proportional": "**Method:** Proportional Deviation (1 - |difference| / population_share)",
+    "ratio": "**Method:** Ratio-based ((Budget Share / Population Share) - 1) × 100"
+}
+
+# Two-decimal display handled by the frontend, keeping formatting off the
+# Python critical path entirely
+_COLUMN_CONFIG = {
+    "Budget Share (%)": st.column_config.NumberColumn(format="%.2f"),
+    "Population Share (%)": st.column_config.NumberColumn(format="%.2f"),
+    "Fairness Ratio": st.column_config.NumberColumn(format="%.2f"),
+    "Fairness Index": st.column_config.NumberColumn(format="%.2f")
+}
+
+
+# ---- Loaders ----
+def load_csv(file_bytes: bytes) -> pd.DataFrame:
+    """Parse uploaded CSV bytes; main() keeps the result in session_state."""
+    # usecols skips parsing any extra metadata columns in wide civic CSVs;
+    # raises ValueError when a required column is missing. Arrow-backed
+    # columns make the st.dataframe/st.data_editor send path zero-copy,
+    # since Streamlit serializes frames via Arrow anyway
+    df = pd.read_csv(io.BytesIO(file_bytes), usecols=['sector', 'budget', 'population'],
+                     engine='pyarrow', dtype_backend='pyarrow')
+    # Downcast: float32 is plenty of precision for shares/ratios and halves
+    # the bandwidth of every downstream computation; category deduplicates
+    # the sector strings
+    df['sector'] = df['sector'].astype('category')
+    for col in ('budget', 'population'):
+        # Fill outside Arrow: coercing an Arrow string column yields NaN
+        # (not null), which Arrow-backed fillna would leave in place
+        numeric = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float32)
+        df[col] = pd.array(np.nan_to_num(numeric), dtype='float32[pyarrow]')
+    # Sector as index makes the chart a plain column select instead of a
+    # set_index copy on every rerun
+    return df.set_index('sector')
+
+
+@st.cache_data(show_spinner=False)
+def compute_metrics_cached(df, fairness_method="difference"):
+    """Memoized wrapper so identical (data, method) pairs skip recomputation."""
+    return compute_metrics(df, fairness_method)
+
 
 # ---- Civic Metrics ----
 def compute_metrics(df, fairness_method="difference"):
-    df = df.copy()
-
-    # Ensure numeric types
-    df['budget'] = pd.to_numeric(df['budget'], errors='coerce').fillna(0)
-    df['population'] = pd.to_numeric(df['population'], errors='coerce').fillna(0)
-
-    total_budget = df['budget'].sum()
-    total_population = df['population'].sum()
-
-    # Avoid division by zero
+    # Ensure numeric types, then work on raw NumPy arrays to avoid
+    # allocating an intermediate Series per arithmetic step. Zero out NaNs
+    # after leaving Arrow — fillna on Arrow dtypes only fills nulls, so a
+    # coerced junk cell would otherwise poison the sums
+    b = np.nan_to_num(pd.to_numeric(df['budget'], errors='coerce').to_numpy(dtype=np.float64))
+    p = np.nan_to_num(pd.to_numeric(df['population'], errors='coerce').to_numpy(dtype=np.float64))
+
+    total_budget = b.sum()
+    total_population = p.sum()
+
+    # Avoid division by zero: one shared zeros array instead of four
+    # separate Series assignments
     if total_budget == 0 or total_population == 0:
-        df['budget_share'] = 0
-        df['population_share'] = 0
-        df['fairness_index'] = 0
-        df['fairness_ratio'] = 0
-        return df
+        zeros = np.zeros(len(df), dtype=np.float32)
+        return df.assign(
+            budget_share=zeros,
+            population_share=zeros,
+            fairness_index=zeros,
+            fairness_ratio=zeros,
+        )
+
+    # A single sector trivially holds the whole budget and population:
+    # shares are 100% and fairness is perfect by definition
+    if len(df) == 1:
+        return df.assign(
+            budget_share=100.0,
+            population_share=100.0,
+            fairness_index=100.0 if fairness_method == "proportional" else 0.0,
+            fairness_ratio=1.0,
+        )
+
+    # Large frames (ward-level data): one fused pass instead of seven
+    # chained array operations
+    if njit is not None and len(df) >= _NUMBA_MIN_ROWS and fairness_method in _METHOD_IDS:
+        bs, ps, fi, fr = (np.empty_like(b) for _ in range(4))
+        _fairness_kernel(b, p, _METHOD_IDS[fairness_method], bs, ps, fi, fr)
+        return df.assign(
+            budget_share=bs,
+            population_share=ps,
+            fairness_index=fi,
+            fairness_ratio=fr,
+        )
 
     # Calculate shares
-    df['budget_share'] = (df['budget'] / total_budget) * 100
-    df['population_share'] = (df['population'] / total_population) * 100
+    bs = b * (100.0 / total_budget)
+    ps = p * (100.0 / total_population)
 
     # ---- Fairness Methods ----
-    if fairness_method == "difference":
-        df['fairness_index'] = df['budget_share'] - df['population_share']
-
-    elif fairness_method == "proportional":
-        df['fairness_index'] = 1 - (abs(df['budget_share'] - df['population_share']) / df['population_share'].replace(0, 1))
-        df['fairness_index'] = df['fairness_index'].clip(0, 1) * 100  # Scale 0–100%
-
-    elif fairness_method == "ratio":
-        df['fairness_index'] = ((df['budget_share'] / df['population_share'].replace(0, 1)) - 1) * 100
+    # All three methods are algebraic functions of (bs, ps, diff); compute
+    # diff once and dispatch through a table, so only the selected formula
+    # touches the arrays
+    diff = np.subtract(bs, ps)
+    # One div-by-zero guard shared by every formula and the ratio column,
+    # instead of rebuilding the mask per use
+    safe_ps = np.where(ps != 0, ps, 1.0)
+    methods = {
+        "difference": lambda: diff,
+        # Proportional deviation, scaled 0–100%. Only one entry ever runs,
+        # so the abs may overwrite the diff buffer instead of allocating a
+        # second array
+        "proportional": lambda: np.clip(1 - np.abs(diff, out=diff) / safe_ps, 0, 1) * 100,
+        "ratio": lambda: (bs / safe_ps - 1) * 100,
+    }
+    fi = methods.get(fairness_method, lambda: np.zeros_like(bs))()
 
     # Add Fairness Ratio (Budget/Population)
-    df['fairness_ratio'] = df['budget_share'] / df['population_share'].replace(0, 1)
-
-    return df
+    return df.assign(
+        budget_share=bs,
+        population_share=ps,
+        fairness_index=fi,
+        fairness_ratio=bs / safe_ps,
+    )
 
 
 # ---- Charts ----
+@st.cache_data(show_spinner=False)
+def build_share_chart(df):
+    """Build the shares figure once per (data, metrics) state; reruns that
+    don't change the frame reshow the cached spec."""
+    chart_data = df[['budget_share', 'population_share']].reset_index()
+    return px.bar(chart_data, x='sector', y=['budget_share', 'population_share'],
+                  barmode='group', labels={'value': 'share (%)', 'variable': ''})
+
+
 def render_chart(df):
-    chart_data = df.set_index('sector')[['budget_share', 'population_share']]
-    st.bar_chart(chart_data)
+    st.plotly_chart(build_share_chart(df), use_container_width=True)
 
 
-def render_table(df):
+def render_table(df, editable=False):
     st.subheader("Civic Data Table")
-    if hasattr(st, 'data_editor'):
-        df_edit = st.data_editor(df, num_rows="dynamic")
-    else:
-        st.dataframe(df)
-        df_edit = df
-    return df_edit
+    if editable and hasattr(st, 'data_editor'):
+        return st.data_editor(df, num_rows="dynamic")
+    st.dataframe(df)
+    return df
 
 
 def render_fairness_index(df, fairness_method):
     avg_fairness = df['fairness_index'].mean()
     st.subheader("Overall Fairness Index")
+    st.metric("Fairness Index (Average)", f"{avg_fairness:.2f}%")
 
     if fairness_method == "proportional":
-        st.metric("Fairness Index (Average)", f"{avg_fairness:.2f}%")
-        st.info("Higher percentage = more fair (100% = perfectly proportional)")
+        st.info(_FAIRNESS_NOTES["proportional"])
+    elif avg_fairness < 0:
+        st.info(_FAIRNESS_NOTES["negative"])
     else:
-        st.metric("Fairness Index (Average)", f"{avg_fairness:.2f}%")
-        if avg_fairness < 0:
-            st.info("Negative values indicate under-funding relative to population share.")
-        else:
-            st.success("Positive values indicate over-funding relative to population share.")
+        st.success(_FAIRNESS_NOTES["positive"])
 
 
 def render_fairness_table(df, fairness_method):
     st.subheader("Fairness Calculator (Detail by Sector)")
 
     # Explanation
-    explanations = {
-        "difference": "**Method:** Simple Difference (Budget Share % - Population Share %)",
-        "proportional": "**Method:** Proportional Deviation (1 - |difference| / population_share)",
-        "ratio": "**Method:** Ratio-based ((Budget Share / Population Share) - 1) × 100"
-    }
-    st.write(explanations.get(fairness_method, ""))
+    st.write(_EXPLANATIONS.get(fairness_method, ""))
 
-    df_display = df[['sector', 'budget', 'population', 'budget_share',
-                     'population_share', 'fairness_index', 'fairness_ratio']].copy()
+    df_display = df.reset_index()[['sector', 'budget', 'population', 'budget_share',
+                                   'population_share', 'fairness_index', 'fairness_ratio']]
 
     df_display.columns = [
         "Sector", "Budget", "Population", "Budget Share (%)",
         "Population Share (%)", "Fairness Index", "Fairness Ratio"
     ]
 
-    format_dict = {
-        "Budget Share (%)": "{:.2f}",
-        "Population Share (%)": "{:.2f}",
-        "Fairness Ratio": "{:.2f}",
-        "Fairness Index": "{:.2f}"
-    }
-
-    st.dataframe(df_display.style.format(format_dict))
+    st.dataframe(df_display, column_config=_COLUMN_CONFIG)
 
 
 def render_storytelling(df, fairness_method):
     st.subheader("AI Storytelling")
 
+    fi = df['fairness_index'].to_numpy()
     if fairness_method == "proportional":
-        worst_idx = df['fairness_index'].idxmin()
-        sector = df.loc[worst_idx, 'sector']
-        fairness = df.loc[worst_idx, 'fairness_index']
+        pos = fi.argmin()
+        sector = df.index[pos]
+        fairness = fi[pos]
         st.write(f"📉 **{sector}** shows the lowest fairness ({fairness:.1f}%), indicating the largest proportional mismatch.")
     else:
-        largest_gap = df['fairness_index'].abs().idxmax()
-        sector = df.loc[largest_gap, 'sector']
-        delta = df.loc[largest_gap, 'fairness_index']
+        pos = np.abs(fi).argmax()
+        sector = df.index[pos]
+        delta = fi[pos]
         if delta < 0:
             st.write(f"📉 **{sector}** appears under-funded (deviation: {delta:.2f}%).")
         else:
@@ -128,12 +260,9 @@ def main():
     fairness_method = st.sidebar.selectbox(
         "Select Fairness Index Method:",
         ["difference", "proportional", "ratio"],
-        format_func=lambda x: {
-            "difference": "Simple Difference",
-            "proportional": "Proportional Deviation",
-            "ratio": "Ratio-based"
-        }[x]
+        format_func=_METHOD_LABELS.get
     )
+    editable = st.sidebar.checkbox("Enable editing", value=False)
 
     st.sidebar.markdown("---")
 
@@ -144,19 +273,34 @@ def main():
         return
 
     try:
-        df = pd.read_csv(uploaded_file)
-        if not {'sector', 'budget', 'population'}.issubset(df.columns):
+        # Hold the parsed frame in session_state rather than cache_data:
+        # same rerun persistence without the pickle round-trip per hit.
+        # Re-parse only when a different file is uploaded.
+        file_key = (uploaded_file.file_id, uploaded_file.size)
+        if st.session_state.get('csv_key') != file_key:
+            st.session_state['csv_df'] = load_csv(uploaded_file.getvalue())
+            st.session_state['csv_key'] = file_key
+        df = st.session_state['csv_df']
+        if df.index.name != 'sector' or not _REQUIRED_COLS.issubset(df.columns):
             st.error("CSV must include: sector, budget, population")
             return
+    # The C parser raises ValueError for a missing usecols column; the
+    # pyarrow engine raises ArrowKeyError, a KeyError subclass
+    except (ValueError, KeyError):
+        st.error("CSV must include: sector, budget, population")
+        return
     except Exception as e:
         st.error(f"Error reading CSV: {e}")
         return
 
     # Compute and visualize
-    df = compute_metrics(df, fairness_method)
+    df = compute_metrics_cached(df, fairness_method)
     render_chart(df)
-    df_edit = render_table(df)
-    df_edit = compute_metrics(df_edit, fairness_method)
+    df_edit = render_table(df, editable)
+    # Recompute only when the editor actually changed something; the
+    # common read-only case reuses the metrics computed above
+    if editable and not df_edit.equals(df):
+        df_edit = compute_metrics_cached(df_edit, fairness_method)
     render_fairness_index(df_edit, fairness_method)
     render_fairness_table(df_edit, fairness_method)
     render_storytelling(df_edit, fairness_method)